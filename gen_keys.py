@@ -1,8 +1,8 @@
 # gen_keys.py
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import ed25519
 from cryptography.hazmat.primitives import serialization
 
-key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+key = ed25519.Ed25519PrivateKey.generate()
 private_pem = key.private_bytes(
     encoding=serialization.Encoding.PEM,
     format=serialization.PrivateFormat.PKCS8,
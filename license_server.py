@@ -1,15 +1,29 @@
 # license_server.py
-import os, json, time, re
-from typing import Optional, Dict, Any, List
+import os, time, re, errno, threading, functools, contextlib, asyncio
+from typing import Optional, Dict, Any, List, Set, Tuple, Type, TypeVar
 from datetime import datetime, timezone
 
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel, Field
+from fastapi.responses import FileResponse, ORJSONResponse
+import anyio
 import jwt  # PyJWT
-
-app = FastAPI(title="Ark Watchdog Licensing", version="1.0.0")
+import msgspec
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+import orjson
+
+try:
+    import fcntl
+except ImportError:  # Windows dev boxes: in-process locking only
+    fcntl = None
+
+# FastAPI >= 0.131 deprecates ORJSONResponse; requirements.txt pins below that
+app = FastAPI(
+    title="Ark Watchdog Licensing",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
 
 # ────────────────────────────────────────────────────────────────────────────────
 # Config
@@ -19,9 +33,18 @@ APP_ID = os.environ.get("APP_ID", "ark-watchdog")
 LICENSE_KEYS_FILE = os.environ.get("LICENSE_KEYS_FILE") or os.path.join(
     os.path.dirname(__file__), "valid_keys.json"
 )
+# Append-only log of machine bindings, folded back into LICENSE_KEYS_FILE
+# once it grows past JOURNAL_COMPACT_BYTES
+LICENSE_JOURNAL_FILE = os.environ.get("LICENSE_JOURNAL_FILE") or (
+    os.path.splitext(LICENSE_KEYS_FILE)[0] + ".log"
+)
+JOURNAL_COMPACT_BYTES = int(os.environ.get("JOURNAL_COMPACT_BYTES", str(1 << 20)))
+# Journal fsyncs are batched: one per window, shared by every binding in it
+JOURNAL_FSYNC_INTERVAL_MS = int(os.environ.get("JOURNAL_FSYNC_INTERVAL_MS", "5"))
 TOKEN_TTL = int(os.environ.get("TOKEN_TTL_SECONDS", "86400"))  # 1 day default
 ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")  # set in Render → Environment
 CLOCK_SKEW_SECONDS = int(os.environ.get("TOKEN_CLOCK_SKEW_SECONDS", "120"))
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "4096"))
 
 # ────────────────────────────────────────────────────────────────────────────────
 # Private key loader (supports PEM in env with \n)
@@ -48,38 +71,249 @@ def _load_private_key() -> str:
     )
 
 PRIVATE_KEY_PEM = _load_private_key()
+# Parsed once here; handing PyJWT the PEM text would re-parse it on every token
+_SIGNING_KEY = load_pem_private_key(PRIVATE_KEY_PEM.encode("utf-8"), password=None)
+# Ed25519 keys (gen_keys.py) sign with EdDSA; legacy RSA keys keep RS256
+JWT_ALGORITHM = "EdDSA" if isinstance(_SIGNING_KEY, Ed25519PrivateKey) else "RS256"
+
 BASE_DIR = os.path.dirname(__file__)
 
 # ────────────────────────────────────────────────────────────────────────────────
 # Store helpers
 # ────────────────────────────────────────────────────────────────────────────────
-def read_store() -> Dict[str, Any]:
+# Parsed store is memoized on the (mtime_ns, size) of the base file and the
+# journal; a request only re-parses when either actually changed on disk.
+_STORE_LOCK = threading.Lock()
+# Held (via _write_lock()) across every read-modify-write of the store so
+# concurrent requests can't drop each other's changes. Take it before
+# _STORE_LOCK, never while holding it.
+_WRITE_LOCK = threading.Lock()
+_STORE_CACHE: Dict[str, Any] = {"stat": None, "data": {}}
+# Opened lazily and per process: a descriptor inherited from a --preload
+# master would be shared by every worker
+_JOURNAL_FD: Optional[int] = None
+_JOURNAL_PID: Optional[int] = None
+# Number of keys in the cached store, so /health never walks the dict
+_KEY_COUNT: int = 0
+# Per-key set mirror of the cached "machines" list, present only once that list
+# is known to be normalized and de-duplicated; reset whenever the store is
+# re-parsed from disk
+_MACHINE_SETS: Dict[str, Set[str]] = {}
+# Last activation response per (key, machine) as (exp, lic, response);
+# re-served while it still has more than half of TOKEN_TTL left and `lic` is
+# still the live record (admin edits swap in a new dict, so a token minted
+# from an older record never matches). Same reset rules as _MACHINE_SETS.
+_TOKEN_CACHE: Dict[Tuple[str, str], Tuple[int, Dict[str, Any], Dict[str, Any]]] = {}
+
+def _file_sig(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _store_stat() -> Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
+    return (_file_sig(LICENSE_KEYS_FILE), _file_sig(LICENSE_JOURNAL_FILE))
+
+def _journal_fd() -> int:
+    global _JOURNAL_FD, _JOURNAL_PID
+    if _JOURNAL_FD is None or _JOURNAL_PID != os.getpid():
+        os.makedirs(os.path.dirname(LICENSE_JOURNAL_FILE) or ".", exist_ok=True)
+        _JOURNAL_FD = os.open(LICENSE_JOURNAL_FILE, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        _JOURNAL_PID = os.getpid()
+    return _JOURNAL_FD
+
+@contextlib.contextmanager
+def _write_lock():
+    """_WRITE_LOCK plus an flock on "<store>.lock", so separate worker
+    processes also serialize their read-modify-write of the store."""
+    with _WRITE_LOCK:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(LICENSE_KEYS_FILE) or ".", exist_ok=True)
+        fd = os.open(LICENSE_KEYS_FILE + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # drops the flock
+
+def _slurp(path: str) -> bytes:
+    """Whole file in one read() — no buffered/text layer for a one-shot load."""
+    fd = os.open(path, os.O_RDONLY)
     try:
-        with open(LICENSE_KEYS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return os.read(fd, os.fstat(fd).st_size)
+    finally:
+        os.close(fd)
+
+def _repair_journal_tail(fd: int) -> int:
+    """Cut a partial last line left by a crash mid-append, so the next entry
+    starts on its own line instead of being glued onto garbage. Returns the
+    resulting journal size."""
+    size = os.fstat(fd).st_size
+    if not size or os.pread(fd, 1, size - 1) == b"\n":
+        return size
+    size = os.pread(fd, size, 0).rfind(b"\n") + 1
+    os.ftruncate(fd, size)
+    return size
+
+def _replay_journal(data: Dict[str, Any]) -> None:
+    try:
+        lines = _slurp(LICENSE_JOURNAL_FILE).splitlines()
     except FileNotFoundError:
-        return {}
-    except json.JSONDecodeError:
-        return {}
+        return
+    for line in lines:
+        try:
+            entry = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            continue  # torn tail from a crash mid-write
+        lic = data.get(entry.get("key"))
+        if lic is None:
+            continue
+        machines = lic.setdefault("machines", [])
+        if entry.get("op") == "bind":
+            if entry.get("machine") not in machines:
+                machines.append(entry["machine"])
+        elif entry.get("op") == "unbind":
+            lic["machines"] = [m for m in machines if _norm_machine(m) != entry.get("machine")]
+
+def read_store() -> Dict[str, Any]:
+    global _KEY_COUNT
+    with _STORE_LOCK:
+        sig = _store_stat()
+        if sig == (None, None):
+            _STORE_CACHE["stat"], _STORE_CACHE["data"] = None, {}
+            _KEY_COUNT = 0
+            return _STORE_CACHE["data"]
+        if sig == _STORE_CACHE["stat"]:
+            return _STORE_CACHE["data"]
+        try:
+            data = orjson.loads(_slurp(LICENSE_KEYS_FILE))
+        except FileNotFoundError:
+            data = {}
+        except orjson.JSONDecodeError:
+            data = {}
+        _replay_journal(data)
+        _MACHINE_SETS.clear()
+        _TOKEN_CACHE.clear()
+        _STORE_CACHE["stat"], _STORE_CACHE["data"] = sig, data
+        _KEY_COUNT = len(data)
+        return data
 
 def write_store(data: Dict[str, Any]) -> None:
+    global _KEY_COUNT
     os.makedirs(os.path.dirname(LICENSE_KEYS_FILE) or ".", exist_ok=True)
     tmp = LICENSE_KEYS_FILE + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-    os.replace(tmp, LICENSE_KEYS_FILE)
-
-def _norm_machine(m: str) -> str:
-    """Canonicalize any incoming machine string to 16-char lowercase hex."""
+    with _STORE_LOCK:
+        try:
+            with open(tmp, "wb") as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+                f.flush()
+                # must be durable before the journal it replaces is truncated
+                os.fsync(f.fileno())
+            os.replace(tmp, LICENSE_KEYS_FILE)
+            # the snapshot now holds every journaled binding
+            fd = _journal_fd()
+            if os.fstat(fd).st_size:
+                os.ftruncate(fd, 0)
+        except BaseException:
+            # whatever made it to disk, the cache can no longer vouch for it
+            _STORE_CACHE["stat"] = None
+            raise
+        # next read is an in-memory hit
+        _STORE_CACHE["stat"], _STORE_CACHE["data"] = _store_stat(), data
+        _KEY_COUNT = len(data)
+
+def _append_journal(entry: Dict[str, Any]) -> None:
+    """Persist one change in a single write(). The caller applies it to the
+    dict returned by read_store() only once this returns, then calls
+    _maybe_compact(); a failed write leaves the cache untouched."""
+    buf = orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE)
+    with _STORE_LOCK:
+        fresh = _store_stat() == _STORE_CACHE["stat"]
+        fd = _journal_fd()
+        # checked on every append (callers hold _write_lock), since any worker
+        # that crashed mid-write can leave a torn tail behind
+        start = _repair_journal_tail(fd)
+        if os.write(fd, buf) != len(buf):
+            os.ftruncate(fd, start)
+            _STORE_CACHE["stat"] = None
+            raise OSError(errno.EIO, "short write to license journal")
+        # if someone else touched the files since our last read, force a re-parse
+        _STORE_CACHE["stat"] = _store_stat() if fresh else None
+
+def _maybe_compact() -> None:
+    if os.fstat(_journal_fd()).st_size > JOURNAL_COMPACT_BYTES:
+        write_store(read_store())
+
+class _GroupCommit:
+    """Group commit for journal fsyncs.
+
+    Appends still go straight to the journal with os.write(), so other workers
+    see them immediately; only the fsync is deferred. Callers await wait()
+    after their write, and a single fsync per interval resolves every caller
+    that arrived during that window.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._waiters: List[asyncio.Future] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def wait(self) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush())
+        await fut
+
+    async def _flush(self) -> None:
+        await asyncio.sleep(self.interval)
+        # later arrivals start the next window; their write may miss this fsync
+        waiters, self._waiters, self._task = self._waiters, [], None
+        try:
+            await anyio.to_thread.run_sync(os.fsync, _journal_fd())
+        except OSError as exc:
+            # the bindings in this window may not be durable: stop trusting the
+            # in-memory copy and re-read whatever the files actually hold
+            with _STORE_LOCK:
+                _STORE_CACHE["stat"] = None
+            for fut in waiters:
+                if not fut.done():
+                    fut.set_exception(exc)
+        else:
+            for fut in waiters:
+                if not fut.done():
+                    fut.set_result(None)
+
+_JOURNAL_COMMIT = _GroupCommit(JOURNAL_FSYNC_INTERVAL_MS / 1000)
+
+read_store()  # warm the cache and _KEY_COUNT
+
+_HEX16_RE = re.compile(r"[0-9a-f]{16,}")
+_NON_HEX_RE = re.compile(r"[^0-9a-f]")
+
+def _canon_machine(m: str) -> str:
     m = (m or "").strip().lower()
     # allow 32/64+ hex — then trim
-    if re.fullmatch(r"[0-9a-f]{16,}", m):
+    if _HEX16_RE.fullmatch(m):
         return m[:16]
-    only_hex = "".join(ch for ch in m if ch in "0123456789abcdef")
+    only_hex = _NON_HEX_RE.sub("", m)
     if len(only_hex) >= 16:
         return only_hex[:16]
     return m[:16]
 
+_canon_machine_cached = functools.lru_cache(maxsize=4096)(_canon_machine)
+
+def _norm_machine(m: str) -> str:
+    """Canonicalize any incoming machine string to 16-char lowercase hex."""
+    # Only real-sized ids are memoized: this runs on unauthenticated input,
+    # and caching arbitrary client strings would let anyone pin memory.
+    if m and len(m) > 128:
+        return _canon_machine(m)
+    return _canon_machine_cached(m)
+
 def _require_admin(token: Optional[str]):
     if not ADMIN_TOKEN:
         raise HTTPException(status_code=403, detail="admin token not configured")
@@ -89,28 +323,71 @@ def _require_admin(token: Optional[str]):
 # ────────────────────────────────────────────────────────────────────────────────
 # Models
 # ────────────────────────────────────────────────────────────────────────────────
-class ActivatePayload(BaseModel):
+# msgspec structs, decoded straight from the request body by _decode_body()
+# (required fields must come before defaulted ones)
+class ActivatePayload(msgspec.Struct):
     key: str
-    app: str = Field(..., description="should match APP_ID on server")
+    app: str  # should match APP_ID on server
     # accept either of these (client may send one or the other)
     machine: Optional[str] = None
     fingerprint: Optional[str] = None
     version: Optional[int] = None  # ignored; reserved for future use
 
-class UpsertPayload(BaseModel):
+class UpsertPayload(msgspec.Struct):
     key: str
+    expires_unix: int
     active: bool = True
     plan: str = "monthly"
-    expires_unix: int
     seats: int = 1
     user_id: Optional[str] = None
     user_name: Optional[str] = None
     user_email: Optional[str] = None
 
-class RemoveMachinePayload(BaseModel):
+class RemoveMachinePayload(msgspec.Struct):
     key: str
     machine: str
 
+_P = TypeVar("_P")
+_AT_PATH_RE = re.compile(r"^(.*) - at `\$(.*)`$")
+_MISSING_FIELD_RE = re.compile(r"^Object missing required field `(.+)`$")
+
+def _validation_detail(message: str) -> List[Dict[str, Any]]:
+    """Reshape a msgspec error into FastAPI's usual 422 body:
+    [{"type", "loc", "msg"}] with loc rooted at "body"."""
+    loc: List[Any] = ["body"]
+    err_type = "value_error"
+    m = _AT_PATH_RE.match(message)
+    if m:
+        message, path = m.groups()
+        loc += [int(part) if part.isdigit() else part for part in re.findall(r"[^.\[\]]+", path)]
+    m = _MISSING_FIELD_RE.match(message)
+    if m:
+        loc.append(m.group(1))
+        err_type, message = "missing", "Field required"
+    return [{"type": err_type, "loc": loc, "msg": message}]
+
+async def _decode_body(request: Request, model: Type[_P]) -> _P:
+    # strict=False keeps the lax "123" -> 123 coercion clients got from pydantic
+    try:
+        return msgspec.json.decode(await request.body(), type=model, strict=False)
+    except msgspec.ValidationError as exc:
+        raise HTTPException(status_code=422, detail=_validation_detail(str(exc)))
+    except msgspec.DecodeError:
+        raise HTTPException(
+            status_code=422,
+            detail=[{"type": "json_invalid", "loc": ["body"], "msg": "JSON decode error"}],
+        )
+
+def _body_schema(model: type) -> Dict[str, Any]:
+    """openapi_extra for a msgspec body; FastAPI only introspects pydantic."""
+    _, components = msgspec.json.schema_components([model])
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": components[model.__name__]}},
+        }
+    }
+
 # ────────────────────────────────────────────────────────────────────────────────
 # CORS (handy for quick tests; tighten if needed)
 # ────────────────────────────────────────────────────────────────────────────────
@@ -126,8 +403,10 @@ app.add_middleware(
 # ────────────────────────────────────────────────────────────────────────────────
 @app.get("/health")
 def health():
-    store = read_store()
-    return {"ok": True, "app": APP_ID, "keys": len(store), "store": LICENSE_KEYS_FILE}
+    # two stat() calls on the steady state; re-parses only if another worker or
+    # an offline edit (customer-add.py --store-file) changed the files
+    read_store()
+    return {"ok": True, "app": APP_ID, "keys": _KEY_COUNT, "store": LICENSE_KEYS_FILE}
 
 
 @app.get("/admin/dashboard")
@@ -137,8 +416,60 @@ def admin_dashboard():
         raise HTTPException(status_code=404, detail="dashboard not found")
     return FileResponse(dashboard_path)
 
-@app.post("/api/activate")
-def activate(p: ActivatePayload):
+def _issue_token(key: str, lic: Dict[str, Any], machine: str, now: int) -> Dict[str, Any]:
+    """Mint the activation response; `now` is the caller's request timestamp."""
+    # include both 'aud' and 'app' for client compatibility
+    issued_at = max(now - max(CLOCK_SKEW_SECONDS, 0), 0)
+    exp = min(now + TOKEN_TTL, int(lic.get("expires_unix", 0)))
+    payload = {
+        "sub": key,
+        "aud": APP_ID,
+        "app": APP_ID,
+        "machine": machine,
+        "plan": lic.get("plan", "unknown"),
+        "iat": issued_at,
+        "nbf": issued_at,
+        "exp": exp,
+    }
+    token = jwt.encode(payload, _SIGNING_KEY, algorithm=JWT_ALGORITHM)
+    return {"token": token, "expires": exp, "claims": payload}
+
+def _forget_tokens(key: str) -> None:
+    for cache_key in list(_TOKEN_CACHE):
+        if cache_key[0] == key:
+            _TOKEN_CACHE.pop(cache_key, None)
+
+def _bind_machine(key: str, nmach: str, now: int) -> bool:
+    """Seat-check and journal a machine for key under the write lock.
+    Returns True if a new binding was written (and still needs its fsync)."""
+    with _write_lock():
+        lic = read_store().get(key)
+        if not lic:
+            raise HTTPException(status_code=403, detail="invalid key")
+        seats = int(lic.get("seats", 1))
+        machine_set = _MACHINE_SETS.get(key)
+        if machine_set is None:
+            # normalize any existing machines once per loaded store
+            machines: List[str] = [_norm_machine(x) for x in lic.get("machines", [])]
+            machines = list(dict.fromkeys(machines))  # de-dup preserve order
+            lic["machines"] = machines
+            machine_set = _MACHINE_SETS[key] = set(machines)
+
+        if nmach in machine_set:
+            return False
+        if len(machine_set) >= seats:
+            raise HTTPException(status_code=409, detail="seat limit reached")
+        # persist first (journal only; compacted into the store file later) so a
+        # failed write never leaves an unsaved seat in memory
+        _append_journal({"op": "bind", "key": key, "machine": nmach, "ts": now})
+        lic["machines"].append(nmach)
+        machine_set.add(nmach)
+        _maybe_compact()
+        return True
+
+@app.post("/api/activate", openapi_extra=_body_schema(ActivatePayload))
+async def activate(request: Request):
+    p = await _decode_body(request, ActivatePayload)
     if p.app != APP_ID:
         raise HTTPException(status_code=403, detail="app mismatch")
 
@@ -147,7 +478,7 @@ def activate(p: ActivatePayload):
     if not nmach:
         raise HTTPException(status_code=422, detail="machine/fingerprint required")
 
-    store = read_store()
+    store = await anyio.to_thread.run_sync(read_store)
     lic = store.get(p.key)
     if not lic:
         raise HTTPException(status_code=403, detail="invalid key")
@@ -159,70 +490,88 @@ def activate(p: ActivatePayload):
     if exp_unix <= now:
         raise HTTPException(status_code=402, detail="expired")
 
-    seats = int(lic.get("seats", 1))
-    # normalize any existing machines
-    machines: List[str] = [_norm_machine(x) for x in lic.get("machines", [])]
-    machines = list(dict.fromkeys(machines))  # de-dup preserve order
-
-    if nmach not in machines:
-        if len(machines) >= seats:
-            raise HTTPException(status_code=409, detail="seat limit reached")
-        machines.append(nmach)
-        # persist
-        lic["machines"] = machines
-        store[p.key] = lic
-        write_store(store)
-
-    # Mint token (include both 'aud' and 'app' for client compatibility)
-    issued_at = max(now - max(CLOCK_SKEW_SECONDS, 0), 0)
-    exp = min(now + TOKEN_TTL, exp_unix)
-    payload = {
-        "sub": p.key,
-        "aud": APP_ID,
-        "app": APP_ID,
-        "machine": nmach,
-        "plan": lic.get("plan", "unknown"),
-        "iat": issued_at,
-        "nbf": issued_at,
-        "exp": exp,
-    }
-    token = jwt.encode(payload, PRIVATE_KEY_PEM, algorithm="RS256")
-    return {"token": token, "expires": exp, "claims": payload}
+    machine_set = _MACHINE_SETS.get(p.key)
+    if machine_set is None or nmach not in machine_set:
+        if await anyio.to_thread.run_sync(_bind_machine, p.key, nmach, now):
+            await _JOURNAL_COMMIT.wait()
+
+    cached = _TOKEN_CACHE.get((p.key, nmach))
+    if cached and cached[1] is lic and cached[0] > now + TOKEN_TTL // 2:
+        return cached[2]
+    resp = _issue_token(p.key, lic, nmach, now)
+    if TOKEN_CACHE_SIZE > 0:  # 0 disables the cache
+        cache_key = (p.key, nmach)
+        if cache_key not in _TOKEN_CACHE and len(_TOKEN_CACHE) >= TOKEN_CACHE_SIZE:
+            try:
+                _TOKEN_CACHE.pop(next(iter(_TOKEN_CACHE)), None)  # oldest first
+            except (StopIteration, RuntimeError):
+                pass  # cleared by a store reload on another thread
+        _TOKEN_CACHE[cache_key] = (resp["expires"], lic, resp)
+    return resp
 
 # ── Admin endpoints ─────────────────────────────────────────────────────────────
-@app.post("/admin/upsert")
-def admin_upsert(payload: UpsertPayload, x_admin_token: str = Header(default="")):
+@app.post("/admin/upsert", openapi_extra=_body_schema(UpsertPayload))
+async def admin_upsert(request: Request, x_admin_token: str = Header(default="")):
     _require_admin(x_admin_token)
-    store = read_store()
-    lic = store.get(payload.key, {})
-    lic.update({
-        "active": bool(payload.active),
-        "plan": payload.plan,
-        "expires_unix": int(payload.expires_unix),
-        "seats": int(payload.seats),
-        "machines": [_norm_machine(m) for m in lic.get("machines", [])],
-    })
-    if payload.user_id is not None:
-        lic["user_id"] = payload.user_id
-    if payload.user_name is not None:
-        lic["user_name"] = payload.user_name
-    if payload.user_email is not None:
-        lic["user_email"] = payload.user_email
-    store[payload.key] = lic
-    write_store(store)
+    payload = await _decode_body(request, UpsertPayload)
+    return await anyio.to_thread.run_sync(_upsert_license, payload)
+
+def _upsert_license(payload: UpsertPayload) -> Dict[str, Any]:
+    with _write_lock():
+        store = read_store()
+        current = store.get(payload.key)
+        lic = dict(current or {})
+        lic.update({
+            "active": bool(payload.active),
+            "plan": payload.plan,
+            "expires_unix": int(payload.expires_unix),
+            "seats": int(payload.seats),
+            "machines": [_norm_machine(m) for m in lic.get("machines", [])],
+        })
+        if payload.user_id is not None:
+            lic["user_id"] = payload.user_id
+        if payload.user_name is not None:
+            lic["user_name"] = payload.user_name
+        if payload.user_email is not None:
+            lic["user_email"] = payload.user_email
+        if lic == current:
+            # idempotent re-provisioning: skip the rewrite
+            return {"ok": True, "key": payload.key, "machines": lic["machines"]}
+        # copy-on-write: readers may be iterating the cached dict right now
+        new_store = dict(store)
+        new_store[payload.key] = lic
+        _MACHINE_SETS.pop(payload.key, None)
+        write_store(new_store)
+        _forget_tokens(payload.key)
     return {"ok": True, "key": payload.key, "machines": lic["machines"]}
 
-@app.post("/admin/remove_machine")
-def admin_remove_machine(payload: RemoveMachinePayload, x_admin_token: str = Header(default="")):
+@app.post("/admin/remove_machine", openapi_extra=_body_schema(RemoveMachinePayload))
+async def admin_remove_machine(request: Request, x_admin_token: str = Header(default="")):
     _require_admin(x_admin_token)
-    store = read_store()
-    lic = store.get(payload.key)
-    if not lic:
-        raise HTTPException(status_code=404, detail="not found")
-    tgt = _norm_machine(payload.machine)
-    lic["machines"] = [m for m in [_norm_machine(x) for x in lic.get("machines", [])] if m != tgt]
-    store[payload.key] = lic
-    write_store(store)
+    payload = await _decode_body(request, RemoveMachinePayload)
+    return await anyio.to_thread.run_sync(_remove_machine, payload)
+
+def _remove_machine(payload: RemoveMachinePayload) -> Dict[str, Any]:
+    with _write_lock():
+        store = read_store()
+        lic = store.get(payload.key)
+        if not lic:
+            raise HTTPException(status_code=404, detail="not found")
+        tgt = _norm_machine(payload.machine)
+        lic = {
+            **lic,
+            "machines": [m for m in [_norm_machine(x) for x in lic.get("machines", [])] if m != tgt],
+        }
+        # journal the removal first: a crash after write_store() replaces the
+        # snapshot but before it truncates the journal would otherwise let
+        # replay re-add the machine from an older "bind" entry
+        _append_journal({"op": "unbind", "key": payload.key, "machine": tgt, "ts": int(time.time())})
+        # copy-on-write: readers may be iterating the cached dict right now
+        new_store = dict(store)
+        new_store[payload.key] = lic
+        _MACHINE_SETS.pop(payload.key, None)
+        write_store(new_store)
+        _forget_tokens(payload.key)
     return {"ok": True, "machines": lic["machines"]}
 
 @app.get("/admin/get/{key}")